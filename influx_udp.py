@@ -8,6 +8,7 @@ class InfluxLineProtocol(asyncio.DatagramProtocol):
     def __init__(self, loop):
         self.loop = loop
         self.transport = None
+        self.error = None
 
     def connection_made(self, transport):
         self.transport = transport
@@ -48,15 +49,8 @@ class InfluxLineProtocol(asyncio.DatagramProtocol):
             msg += " {:d}".format(timestamp)
         return msg
 
-    def write_one(self, *args, **kwargs):
-        msg = self.fmt(*args, **kwargs)
-        logger.debug(msg)
-        self.transport.sendto(msg.encode())
-
-    def write_many(self, lines):
-        msg = "\n".join(lines)
-        logger.debug(msg)
-        self.transport.sendto(msg.encode())
+    def write(self, data):
+        self.transport.sendto(data)
 
     def datagram_received(self, data, addr):
         logger.error("recvd %s %s", data, addr)
@@ -64,6 +58,9 @@ class InfluxLineProtocol(asyncio.DatagramProtocol):
 
     def error_received(self, exc):
         logger.error("error %s", exc)
+        self.error = exc
 
     def connection_lost(self, exc):
         logger.info("lost conn %s", exc)
+        if exc is not None:
+            self.error = exc
@@ -27,6 +27,7 @@ import dbus
 import dbus.mainloop.glib
 
 from influx_udp import InfluxLineProtocol
+from sinks import FanOut
 from sensortag import TagManager, DEVICE
 
 
@@ -70,12 +71,7 @@ def main():
         return InfluxLineProtocol.fmt("sensortag", data, tags=dict(
             address=tag.address), timestamp=t)
 
-    async def log(m):
-        idb_transport, idb = await loop.create_datagram_endpoint(
-            lambda: InfluxLineProtocol(loop),
-            remote_addr=(cfg["influxdb_udp"]["host"],
-                         int(cfg["influxdb_udp"]["port"])))
-
+    async def log(m, sinks):
         await m.start()
 
         while True:
@@ -95,12 +91,14 @@ def main():
                     if r:
                         msg.append(r)
             if msg:
-                idb.write_many(msg)
+                sinks.write_many(msg)
             await asyncio.sleep(float(cfg["logger"]["measure"]))
 
     m = TagManager()
+    sinks = FanOut.from_config(cfg, loop)
+    sinks.start()
 
-    log_task = loop.create_task(log(m))
+    log_task = loop.create_task(log(m, sinks))
 
     discover_task = loop.create_task(m.auto_discover(
             float(cfg["logger"]["discover_interval"]),
@@ -112,6 +110,11 @@ def main():
         m._auto_discover = False
         discover_task.cancel()
         log_task.cancel()
+        loop.create_task(shutdown())
+
+    async def shutdown():
+        await sinks.stop(cfg.getfloat("logger", "drain_timeout",
+                                      fallback=10.))
         loop.stop()
 
     for sig in signal.SIGINT, signal.SIGTERM:
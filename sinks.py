@@ -0,0 +1,267 @@
+# Copyright 2016 Robert Jordens <jordens@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from influx_udp import InfluxLineProtocol
+
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(ABC):
+    """Deliver encoded batches to one destination.
+
+    Each sink owns a bounded queue drained by its own task. A full queue
+    drops the oldest batch so that a slow or dead sink never blocks the
+    measurement loop or the other sinks. A failed write is retried
+    `retries` times with exponential backoff before the batch is dropped.
+    """
+    def __init__(self, name, loop, queue=16, retries=3, backoff=1.):
+        self.name = name
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue)
+        self.retries = retries
+        self.backoff = backoff
+        self.healthy = True
+        self.failures = 0
+        self.dropped = 0
+
+    @staticmethod
+    def options(section):
+        queue = section.getint("queue", 16)
+        if queue < 1:
+            raise ValueError("queue must be at least 1")
+        return dict(queue=queue,
+                    retries=section.getint("retries", 3),
+                    backoff=section.getfloat("backoff", 1.))
+
+    @classmethod
+    def from_config(cls, name, section, loop):
+        return cls(name, loop, **cls.options(section))
+
+    def put(self, data):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+            logger.warning("%s: queue full, dropping oldest batch", self.name)
+        self.queue.put_nowait(data)
+
+    @abstractmethod
+    async def write(self, data):
+        """Deliver one batch, raise on failure."""
+
+    def close(self):
+        pass
+
+    async def shutdown(self):
+        """Release all resources once the drain task has ended."""
+        self.close()
+
+    async def send(self, data):
+        for i in range(self.retries + 1):
+            if i:
+                await asyncio.sleep(self.backoff*2**(i - 1))
+            try:
+                await self.write(data)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                if self.healthy:
+                    logger.warning("%s: write failed", self.name,
+                                   exc_info=True)
+                self.healthy = False
+                self.close()
+            else:
+                if not self.healthy:
+                    logger.info("%s: recovered", self.name)
+                self.healthy = True
+                return
+        self.dropped += 1
+        logger.error("%s: giving up on batch", self.name)
+
+    async def run(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                try:
+                    await self.send(data)
+                finally:
+                    self.queue.task_done()
+        finally:
+            self.close()
+
+
+class UDPSink(Sink):
+    """Send batches as InfluxDB UDP datagrams.
+
+    Send errors (e.g. ICMP port unreachable) are reported asynchronously
+    and are raised on the next write, which then gets retried on a fresh
+    endpoint. The datagram that caused the error is not resent.
+    """
+    def __init__(self, name, loop, host, port, **kwargs):
+        super().__init__(name, loop, **kwargs)
+        self.host = host
+        self.port = port
+        self.transport = None
+        self.protocol = None
+
+    @staticmethod
+    def options(section):
+        kwargs = Sink.options(section)
+        kwargs.update(host=section["host"], port=int(section["port"]))
+        return kwargs
+
+    async def open(self):
+        self.transport, self.protocol = \
+            await self.loop.create_datagram_endpoint(
+                lambda: InfluxLineProtocol(self.loop),
+                remote_addr=(self.host, self.port))
+
+    def check(self):
+        exc, self.protocol.error = self.protocol.error, None
+        if exc is not None:
+            raise exc
+
+    async def write(self, data):
+        if self.transport is None or self.transport.is_closing():
+            await self.open()
+        self.check()
+        self.protocol.write(data)
+        self.check()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class FileSink(Sink):
+    """Append batches to a line protocol file."""
+    def __init__(self, name, loop, path, **kwargs):
+        super().__init__(name, loop, **kwargs)
+        self.path = path
+        self.file = None
+        # file i/o blocks, keep it off the event loop; a single worker
+        # orders close() after any pending write
+        self.executor = ThreadPoolExecutor(1)
+
+    @staticmethod
+    def options(section):
+        kwargs = Sink.options(section)
+        kwargs.update(path=section["path"])
+        return kwargs
+
+    def _write(self, data):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        self.file.write(data)
+        self.file.write(b"\n")
+        self.file.flush()
+
+    def _close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    async def write(self, data):
+        await self.loop.run_in_executor(self.executor, self._write, data)
+
+    def close(self):
+        self.executor.submit(self._close)
+
+    async def shutdown(self):
+        await self.loop.run_in_executor(self.executor, self._close)
+        self.executor.shutdown()
+
+
+sink_types = {
+    "udp": UDPSink,
+    "file": FileSink,
+}
+
+
+class FanOut:
+    """Encode each batch once and hand the same buffer to all sinks."""
+    def __init__(self, sinks, loop):
+        self.sinks = sinks
+        self.loop = loop
+        self.tasks = []
+
+    @classmethod
+    def from_config(cls, cfg, loop):
+        sinks = []
+        names = cfg.get("logger", "sinks", fallback="influxdb_udp")
+        names = names.replace(",", " ").split()
+        if not names:
+            raise ValueError("no sinks in [logger] sinks")
+        for name in names:
+            if names.count(name) > 1:
+                raise ValueError("sink {}: listed more than once in "
+                                 "[logger] sinks".format(name))
+            if not cfg.has_section(name):
+                raise ValueError("sink {}: no section [{}]".format(
+                    name, name))
+            section = cfg[name]
+            typ = section.get("type", "udp")
+            if typ not in sink_types:
+                raise ValueError(
+                    "sink {}: unknown type {!r} in section [{}], "
+                    "expected one of {}".format(
+                        name, typ, name, ", ".join(sorted(sink_types))))
+            try:
+                sinks.append(sink_types[typ].from_config(name, section, loop))
+            except KeyError as e:
+                raise ValueError("sink {}: missing option {} in section "
+                                 "[{}]".format(name, e, name)) from None
+            except ValueError as e:
+                raise ValueError("sink {}: {} in section [{}]".format(
+                    name, e, name)) from None
+        return cls(sinks, loop)
+
+    def start(self):
+        self.tasks = [self.loop.create_task(sink.run())
+                      for sink in self.sinks]
+
+    async def stop(self, timeout=None):
+        """Deliver the queued batches (for at most `timeout` seconds),
+        then stop the sinks."""
+        if self.tasks:
+            joins = {asyncio.ensure_future(sink.queue.join()): sink
+                     for sink in self.sinks}
+            done, pending = await asyncio.wait(joins, timeout=timeout)
+            for fut in pending:
+                logger.warning("%s: timeout draining queue", joins[fut].name)
+                fut.cancel()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for sink in self.sinks:
+            await sink.shutdown()
+
+    def write_many(self, lines):
+        msg = "\n".join(lines)
+        logger.debug(msg)
+        # bytes are immutable: every sink queues a reference to the
+        # same buffer
+        data = msg.encode()
+        for sink in self.sinks:
+            sink.put(data)
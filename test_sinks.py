@@ -0,0 +1,299 @@
+import asyncio
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+from configparser import ConfigParser
+
+from sinks import Sink, UDPSink, FileSink, FanOut
+
+
+class FakeSink(Sink):
+    def __init__(self, *args, fail=0, exc=OSError, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail = fail
+        self.exc = exc
+        self.written = []
+        self.closed = 0
+
+    async def write(self, data):
+        if self.fail:
+            self.fail -= 1
+            raise self.exc("fail")
+        self.written.append(data)
+
+    def close(self):
+        self.closed += 1
+
+
+class StuckSink(Sink):
+    async def write(self, data):
+        await asyncio.Event().wait()
+
+
+class SinkTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def sink(self, cls=FakeSink, **kwargs):
+        kwargs.setdefault("backoff", 0.)
+        return cls("fake", self.loop, **kwargs)
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            Sink("sink", self.loop)
+
+    def test_drop_oldest(self):
+        s = self.sink(queue=2)
+        for i in range(3):
+            s.put(i)
+        self.assertEqual(s.dropped, 1)
+        self.assertEqual([s.queue.get_nowait() for i in range(2)], [1, 2])
+
+    def test_retry(self):
+        s = self.sink(fail=2, retries=3)
+        self.run_async(s.send(b"a"))
+        self.assertEqual(s.written, [b"a"])
+        self.assertEqual(s.failures, 2)
+        self.assertEqual(s.dropped, 0)
+        self.assertTrue(s.healthy)
+
+    def test_give_up(self):
+        delays = []
+
+        async def record(delay):
+            delays.append(delay)
+
+        s = self.sink(fail=10, retries=2, backoff=1.)
+        with mock.patch("sinks.asyncio.sleep", record):
+            self.run_async(s.send(b"a"))
+        self.assertEqual(s.written, [])
+        self.assertEqual(s.failures, 3)
+        self.assertEqual(s.dropped, 1)
+        self.assertEqual(s.closed, 3)
+        self.assertFalse(s.healthy)
+        # no backoff after the last attempt
+        self.assertEqual(delays, [1., 2.])
+
+    def test_other_exception(self):
+        s = self.sink(fail=1, exc=ValueError, retries=0)
+        f = FanOut([s], self.loop)
+
+        async def go():
+            f.start()
+            f.write_many(["a"])
+            f.write_many(["b"])
+            await f.stop(1.)
+        self.run_async(go())
+        self.assertEqual(s.written, [b"b"])
+        self.assertEqual(s.dropped, 1)
+        self.assertTrue(s.healthy)
+
+    def test_shared_buffer(self):
+        a, b = self.sink(), self.sink()
+        f = FanOut([a, b], self.loop)
+
+        async def go():
+            f.start()
+            f.write_many(["m x=1i", "m x=2i"])
+            await f.stop(1.)
+        self.run_async(go())
+        self.assertEqual(a.written, [b"m x=1i\nm x=2i"])
+        self.assertIs(a.written[0], b.written[0])
+
+    def test_stuck_sink(self):
+        a, b = self.sink(StuckSink), self.sink()
+        f = FanOut([a, b], self.loop)
+
+        async def go():
+            f.start()
+            for i in range(3):
+                f.write_many([str(i)])
+            await f.stop(.1)
+        self.run_async(go())
+        self.assertEqual(b.written, [b"0", b"1", b"2"])
+        self.assertEqual(f.tasks, [])
+
+    def test_udp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(1)
+        self.addCleanup(sock.close)
+        s = UDPSink("udp", self.loop, "127.0.0.1", sock.getsockname()[1])
+
+        async def go():
+            await s.write(b"a")
+            s.protocol.error_received(OSError("refused"))
+            with self.assertRaises(OSError):
+                await s.write(b"b")
+            s.close()
+            await s.write(b"c")
+            s.close()
+        self.run_async(go())
+        self.assertEqual(sock.recv(100), b"a")
+        self.assertEqual(sock.recv(100), b"c")
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "x.lp")
+            s = FileSink("file", self.loop, path)
+            self.run_async(s.write(b"a\nb"))
+            self.run_async(s.write(b"c"))
+            self.run_async(s.shutdown())
+            self.assertIsNone(s.file)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"a\nb\nc\n")
+
+    def test_file_fanout(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "x.lp")
+            s = FileSink("file", self.loop, path, queue=4)
+            f = FanOut([s], self.loop)
+
+            async def go():
+                f.start()
+                for i in range(3):
+                    f.write_many([str(i)])
+                await f.stop(1.)
+            self.run_async(go())
+            self.assertEqual(s.dropped, 0)
+            self.assertTrue(s.healthy)
+            self.assertIsNone(s.file)
+            with self.assertRaises(RuntimeError):
+                s.executor.submit(s._close)
+            with open(path, "rb") as fil:
+                self.assertEqual(fil.read(), b"0\n1\n2\n")
+
+
+class ConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def fanout(self, cfg):
+        c = ConfigParser()
+        c.read_string(cfg)
+        return FanOut.from_config(c, self.loop)
+
+    def test_default(self):
+        f = self.fanout("""
+[logger]
+[influxdb_udp]
+host = localhost
+port = 8089
+""")
+        s, = f.sinks
+        self.assertIsInstance(s, UDPSink)
+        self.assertEqual((s.host, s.port), ("localhost", 8089))
+
+    def test_sinks(self):
+        f = self.fanout("""
+[logger]
+sinks = influxdb_udp, archive
+[influxdb_udp]
+host = localhost
+port = 8089
+queue = 4
+retries = 1
+backoff = .5
+[archive]
+type = file
+path = x.lp
+""")
+        a, b = f.sinks
+        self.assertEqual((a.queue.maxsize, a.retries, a.backoff),
+                         (4, 1, .5))
+        self.assertIsInstance(b, FileSink)
+        self.assertEqual((b.name, b.path), ("archive", "x.lp"))
+
+    def test_missing_section(self):
+        with self.assertRaisesRegex(ValueError, r"archive.*\[archive\]"):
+            self.fanout("""
+[logger]
+sinks = archive
+""")
+
+    def test_unknown_type(self):
+        with self.assertRaisesRegex(ValueError, "archive.*'tcp'.*file, udp"):
+            self.fanout("""
+[logger]
+sinks = archive
+[archive]
+type = tcp
+""")
+
+    def test_missing_option(self):
+        with self.assertRaisesRegex(ValueError, "archive.*path"):
+            self.fanout("""
+[logger]
+sinks = archive
+[archive]
+type = file
+""")
+        with self.assertRaisesRegex(ValueError,
+                                    r"influxdb_udp.*port.*\[influxdb_udp\]"):
+            self.fanout("""
+[logger]
+[influxdb_udp]
+host = localhost
+""")
+
+    def test_invalid_option(self):
+        with self.assertRaisesRegex(ValueError, r"influxdb_udp.*'x'"):
+            self.fanout("""
+[logger]
+[influxdb_udp]
+host = localhost
+port = x
+""")
+        with self.assertRaisesRegex(ValueError, r"archive.*'abc'.*\[archive"):
+            self.fanout("""
+[logger]
+sinks = archive
+[archive]
+type = file
+path = x.lp
+queue = abc
+""")
+
+    def test_queue_bounded(self):
+        with self.assertRaisesRegex(ValueError, r"archive.*queue.*\[archive"):
+            self.fanout("""
+[logger]
+sinks = archive
+[archive]
+type = file
+path = x.lp
+queue = 0
+""")
+
+    def test_no_sinks(self):
+        for sinks in "", ",":
+            with self.assertRaisesRegex(ValueError, "no sinks"):
+                self.fanout("""
+[logger]
+sinks = {}
+""".format(sinks))
+
+    def test_duplicate(self):
+        with self.assertRaisesRegex(ValueError, "archive.*more than once"):
+            self.fanout("""
+[logger]
+sinks = archive, archive
+[archive]
+type = file
+path = x.lp
+""")
+
+
+if __name__ == "__main__":
+    unittest.main()